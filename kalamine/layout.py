@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
+import copy
 import datetime
+import functools
 import os
 import re
 import sys
 from typing import Any
 
-import tomli
 import yaml
 from lxml import etree
 
@@ -26,17 +27,43 @@ from .utils import (
     DEAD_KEYS,
     ODK_ID,
     Layer,
+    YAMLLoader,
     lines_to_text,
     load_data,
     open_local_file,
     text_to_lines,
 )
 
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+try:  # optional, faster TOML parser
+    import rtoml
+except ImportError:
+    rtoml = None
+
 ###
 # Helpers
 #
 
 
+UPPER_CUSTOM = {
+    "\u00df": "\u1e9e",  # ß ẞ
+    "\u007c": "\u00a6",  # | ¦
+    "\u003c": "\u2264",  # < ≤
+    "\u003e": "\u2265",  # > ≥
+    "\u2020": "\u2021",  # † ‡
+    "\u2190": "\u21d0",  # ← ⇐
+    "\u2191": "\u21d1",  # ↑ ⇑
+    "\u2192": "\u21d2",  # → ⇒
+    "\u2193": "\u21d3",  # ↓ ⇓
+    "\u00b5": " ",  # µ (to avoid getting `Μ` as uppercase)
+}
+
+
+@functools.lru_cache(maxsize=1024)
 def upper_key(letter):
     """This is used for presentation purposes: in a key, the upper character
     becomes blank if it's an obvious uppercase version of the base character."""
@@ -44,20 +71,8 @@ def upper_key(letter):
     if len(letter) != 1:  # dead key?
         return " "
 
-    custom_alpha = {
-        "\u00df": "\u1e9e",  # ß ẞ
-        "\u007c": "\u00a6",  # | ¦
-        "\u003c": "\u2264",  # < ≤
-        "\u003e": "\u2265",  # > ≥
-        "\u2020": "\u2021",  # † ‡
-        "\u2190": "\u21d0",  # ← ⇐
-        "\u2191": "\u21d1",  # ↑ ⇑
-        "\u2192": "\u21d2",  # → ⇒
-        "\u2193": "\u21d3",  # ↓ ⇓
-        "\u00b5": " ",  # µ (to avoid getting `Μ` as uppercase)
-    }
-    if letter in custom_alpha:
-        return custom_alpha[letter]
+    if letter in UPPER_CUSTOM:
+        return UPPER_CUSTOM[letter]
     if letter.upper() != letter.lower():
         return letter.upper()
 
@@ -65,23 +80,38 @@ def upper_key(letter):
     return " "
 
 
-def substitute_lines(text, variable, lines):
-    prefix = "KALAMINE::"
-    exp = re.compile(".*" + prefix + variable + ".*")
+TPL_PREFIX = "KALAMINE::"
+TPL_TOKEN = re.compile("\\$\\{([^\\}=]+)(=[^\\}]*){0,1}\\}")
+
 
-    indent = ""
-    for line in text.split("\n"):
-        m = exp.match(line)
-        if m:
-            indent = m.group().split(prefix)[0]
-            break
+@functools.lru_cache(maxsize=None)
+def _lines_pattern(variable):
+    return re.compile(".*" + TPL_PREFIX + variable + ".*")
 
-    return exp.sub(lines_to_text(lines, indent), text)
+
+@functools.lru_cache(maxsize=None)
+def _token_pattern(token):
+    return re.compile("\\$\\{" + token + "(=[^\\}]*){0,1}\\}")
+
+
+def substitute_lines(text, variable, lines):
+    def indented_lines(match):
+        indent = match.group().split(TPL_PREFIX)[0]
+        return lines_to_text(lines, indent)
+
+    return _lines_pattern(variable).sub(indented_lines, text)
 
 
 def substitute_token(text, token, value):
-    exp = re.compile("\\$\\{" + token + "(=[^\\}]*){0,1}\\}")
-    return exp.sub(value, text)
+    if "${" + token + "=" not in text:  # no default value: plain replacement
+        return text.replace("${" + token + "}", value)
+    return _token_pattern(token).sub(lambda m: value, text)
+
+
+@functools.lru_cache(maxsize=32)
+def _read_tpl(filename):
+    with open_local_file(os.path.join("tpl", filename)) as file:
+        return file.read()
 
 
 def load_tpl(layout, ext):
@@ -90,21 +120,33 @@ def load_tpl(layout, ext):
         tpl = "full"
         if layout.has_1dk and ext.startswith(".xkb"):
             tpl = "full_1dk"
-    out = open_local_file(os.path.join("tpl", tpl + ext)).read()
+    out = _read_tpl(tpl + ext)
     out = substitute_lines(out, "GEOMETRY_base", layout.base)
     out = substitute_lines(out, "GEOMETRY_full", layout.full)
     out = substitute_lines(out, "GEOMETRY_altgr", layout.altgr)
-    for key, value in layout.meta.items():
-        out = substitute_token(out, key, value)
-    return out
+
+    def meta_value(match):  # unknown tokens are kept for later substitutions
+        name = match.group(1)
+        return str(layout.meta[name]) if name in layout.meta else match.group()
+
+    return TPL_TOKEN.sub(meta_value, out)
+
+
+@functools.lru_cache(maxsize=1)
+def _svg_template():
+    filepath = os.path.join(os.path.dirname(__file__), "tpl", "x-keyboard.svg")
+    return etree.parse(filepath, etree.XMLParser(remove_blank_text=True))
 
 
 def load_descriptor(file_path):
     if file_path.endswith(".yaml") or file_path.endswith(".yml"):
         with open(file_path, encoding="utf-8") as file:
-            return yaml.load(file, Loader=yaml.SafeLoader)
+            return yaml.load(file, Loader=YAMLLoader)
+    if rtoml is not None:
+        with open(file_path, encoding="utf-8") as file:
+            return rtoml.load(file)
     with open(file_path, mode="rb") as file:
-        return tomli.load(file)
+        return tomllib.load(file)
 
 
 ###
@@ -126,7 +168,25 @@ SPACEBAR = {
     "1dk_shift": "'",
 }
 
+LAYER_TEMPLATES = frozenset(["base", "full", "altgr"])
+
+DEAD_KEYS_BY_CHAR = {dk["char"]: dk for dk in DEAD_KEYS}
+DEAD_KEYS_ORDER = [dk["char"] for dk in DEAD_KEYS]
+
 GEOMETRY = load_data("geometry.yaml")
+GEOMETRY_LINES = {  # split once, copied by `_get_geometry`
+    name: shape["template"].split("\n")[:-1] for name, shape in GEOMETRY.items()
+}
+
+SVG_NS = {"svg": "http://www.w3.org/2000/svg"}
+SVG_LEVELS = {  # 1-4 levels: base, shift, altgr, altgr+shift
+    n: etree.XPath(f"svg:g/svg:text[@class='level{n}']", namespaces=SVG_NS)
+    for n in range(1, 5)
+}
+SVG_DK_LEVELS = {  # 5-6 levels: 1dk, 1dk+shift
+    n: etree.XPath(f"svg:g/svg:text[@class='level{n} dk']", namespaces=SVG_NS)
+    for n in range(5, 7)
+}
 
 
 ###
@@ -135,7 +195,13 @@ GEOMETRY = load_data("geometry.yaml")
 
 
 class KeyboardLayout:
-    """Lafayette-style keyboard layout: base + 1dk + altgr layers."""
+    """Lafayette-style keyboard layout: base + 1dk + altgr layers.
+
+    Geometry views and driver outputs are computed once and cached. Setting
+    `geometry` resets them; other changes to `layers` or `meta` made after
+    these outputs have been read are not reflected. The cached `json` dict and
+    `svg` tree are shared between callers and must not be modified.
+    """
 
     def __init__(self, filepath):
         """Import a keyboard layout to instanciate the object."""
@@ -162,14 +228,9 @@ class KeyboardLayout:
             sys.exit(1)
 
         # metadata: self.meta
-        for k in cfg:
-            if (
-                k != "base"
-                and k != "full"
-                and k != "altgr"
-                and not isinstance(cfg[k], dict)
-            ):
-                self.meta[k] = cfg[k]
+        for k, v in cfg.items():
+            if k not in LAYER_TEMPLATES and not isinstance(v, dict):
+                self.meta[k] = v
         filename = os.path.splitext(os.path.basename(filepath))[0]
         self.meta["name"] = cfg["name"] if "name" in cfg else filename
         self.meta["name8"] = cfg["name8"] if "name8" in cfg else self.meta["name"][0:8]
@@ -207,28 +268,17 @@ class KeyboardLayout:
             self.layers[Layer.ALTGR_SHIFT]["spce"] = spc["altgr_shift"]
 
         # active dead keys: self.dk_index
-        for dk in DEAD_KEYS:
-            if dk["char"] in self.dead_keys:
-                self.dk_index.append(dk["char"])
+        self.dk_index = [char for char in DEAD_KEYS_ORDER if char in self.dead_keys]
 
         # remove unused characters in self.dead_keys[].{base,alt}
-        def layer_has_char(char, layer_index):
-            for id in self.layers[layer_index]:
-                if self.layers[layer_index][id] == char:
-                    return True
-            return False
+        used = set(self.layers[Layer.BASE].values())
+        used |= set(self.layers[Layer.SHIFT].values())
 
         for dk_id in self.dead_keys:
             base = self.dead_keys[dk_id]["base"]
             alt = self.dead_keys[dk_id]["alt"]
-            used_base = ""
-            used_alt = ""
-            for i in range(len(base)):
-                if layer_has_char(base[i], Layer.BASE) or layer_has_char(
-                    base[i], Layer.SHIFT
-                ):
-                    used_base += base[i]
-                    used_alt += alt[i]
+            used_base = "".join(b for b, a in zip(base, alt) if b in used)
+            used_alt = "".join(a for b, a in zip(base, alt) if b in used)
             self.dead_keys[dk_id]["base"] = used_base
             self.dead_keys[dk_id]["alt"] = used_alt
 
@@ -238,17 +288,21 @@ class KeyboardLayout:
             odk = self.dead_keys[ODK_ID]
             # alt_self (double-press), alt_space (1dk+space)
             odk["alt_space"] = spc["1dk"]
-            for key in self.layers[Layer.BASE]:
-                if self.layers[Layer.BASE][key] == ODK_ID:
+            for key, char in self.layers[Layer.BASE].items():
+                if char == ODK_ID:
                     odk["alt_self"] = self.layers[Layer.ODK][key]
                     break
             # copy the 2nd and 3rd layers to the dead key
+            odk_base = [odk["base"]]
+            odk_alt = [odk["alt"]]
             for i in [Layer.BASE, Layer.SHIFT]:
                 for name, alt_char in self.layers[i + Layer.ODK].items():
                     base_char = self.layers[i][name]
                     if name != "spce" and base_char != ODK_ID:
-                        odk["base"] += base_char
-                        odk["alt"] += alt_char
+                        odk_base.append(base_char)
+                        odk_alt.append(alt_char)
+            odk["base"] = "".join(odk_base)
+            odk["alt"] = "".join(odk_alt)
 
     def _parse_template(self, template, rows, layer_number):
         """Extract a keyboard layer from a template."""
@@ -263,8 +317,8 @@ class KeyboardLayout:
             i = row["offset"] + col_offset
             keys = row["keys"]
 
-            base = list(template[2 + j * 3])
-            shift = list(template[1 + j * 3])
+            base = template[2 + j * 3]  # read-only: no need for a list copy
+            shift = template[1 + j * 3]
 
             for key in keys:
                 base_key = ("*" if base[i - 1] == "*" else "") + base[i]
@@ -282,11 +336,10 @@ class KeyboardLayout:
                 if shift_key != " ":
                     self.layers[layer_number + 1][key] = shift_key
 
-                for dk in DEAD_KEYS:
-                    if base_key == dk["char"]:
-                        self.dead_keys[base_key] = dk.copy()
-                    if shift_key == dk["char"]:
-                        self.dead_keys[shift_key] = dk.copy()
+                if base_key in DEAD_KEYS_BY_CHAR:
+                    self.dead_keys[base_key] = DEAD_KEYS_BY_CHAR[base_key].copy()
+                if shift_key in DEAD_KEYS_BY_CHAR:
+                    self.dead_keys[shift_key] = DEAD_KEYS_BY_CHAR[shift_key].copy()
 
                 i += 6
 
@@ -296,8 +349,8 @@ class KeyboardLayout:
     # Geometry: base, full, altgr
     #
 
-    def _fill_template(self, template, rows, layer_number):
-        """Fill a template with a keyboard layer."""
+    def _fill_row(self, base, shift, row, layer_number):
+        """Fill a template row (base and shift character lists) with a layer."""
 
         if layer_number == Layer.BASE:
             col_offset = 0
@@ -306,59 +359,48 @@ class KeyboardLayout:
             col_offset = 2
             shift_prevails = False
 
-        j = 0
-        for row in rows:
-            i = row["offset"] + col_offset
-            keys = row["keys"]
+        base_layer = self.layers[layer_number]
+        shift_layer = self.layers[layer_number + 1]
 
-            base = list(template[2 + j * 3])
-            shift = list(template[1 + j * 3])
+        i = row["offset"] + col_offset
+        for key in row["keys"]:
+            base_key = base_layer.get(key, " ")
+            shift_key = shift_layer.get(key, " ")
 
-            for key in keys:
-                base_key = " "
-                if key in self.layers[layer_number]:
-                    base_key = self.layers[layer_number][key]
+            dead_base = len(base_key) == 2 and base_key[0] == "*"
+            dead_shift = len(shift_key) == 2 and shift_key[0] == "*"
+            obvious_shift = upper_key(base_key) == shift_key
 
-                shift_key = " "
-                if key in self.layers[layer_number + 1]:
-                    shift_key = self.layers[layer_number + 1][key]
-
-                dead_base = len(base_key) == 2 and base_key[0] == "*"
-                dead_shift = len(shift_key) == 2 and shift_key[0] == "*"
-
-                if shift_prevails:
-                    shift[i] = shift_key[-1]
-                    if dead_shift:
-                        shift[i - 1] = "*"
-                    if upper_key(base_key) != shift_key:
-                        base[i] = base_key[-1]
-                        if dead_base:
-                            base[i - 1] = "*"
-                else:
+            if shift_prevails:
+                shift[i] = shift_key[-1]
+                if dead_shift:
+                    shift[i - 1] = "*"
+                if not obvious_shift:
                     base[i] = base_key[-1]
                     if dead_base:
                         base[i - 1] = "*"
-                    if upper_key(base_key) != shift_key:
-                        shift[i] = shift_key[-1]
-                        if dead_shift:
-                            shift[i - 1] = "*"
-
-                i += 6
-
-            template[2 + j * 3] = "".join(base)
-            template[1 + j * 3] = "".join(shift)
-            j += 1
+            else:
+                base[i] = base_key[-1]
+                if dead_base:
+                    base[i - 1] = "*"
+                if not obvious_shift:
+                    shift[i] = shift_key[-1]
+                    if dead_shift:
+                        shift[i - 1] = "*"
 
-        return template
+            i += 6
 
     def _get_geometry(self, layers=[Layer.BASE]):
         """`geometry` view of the requested layers."""
 
         rows = GEOMETRY[self.geometry]["rows"]
-        template = GEOMETRY[self.geometry]["template"].split("\n")[:-1]
-        for i in layers:
-            template = self._fill_template(template, rows, i)
-        return template
+        template = [list(line) for line in GEOMETRY_LINES[self.geometry]]
+        for j, row in enumerate(rows):
+            base = template[2 + j * 3]
+            shift = template[1 + j * 3]
+            for i in layers:
+                self._fill_row(base, shift, row, i)
+        return ["".join(line) for line in template]
 
     @property
     def geometry(self):
@@ -372,18 +414,22 @@ class KeyboardLayout:
         if shape not in ["ANSI", "ISO", "ERGO"]:
             shape = "ISO"
         self.meta["geometry"] = shape
+        # drop all cached views and drivers: they depend on the geometry
+        for name, value in vars(KeyboardLayout).items():
+            if isinstance(value, functools.cached_property):
+                self.__dict__.pop(name, None)
 
-    @property
+    @functools.cached_property
     def base(self):
         """Base + 1dk layers."""
         return self._get_geometry([0, Layer.ODK])
 
-    @property
+    @functools.cached_property
     def full(self):
         """Base + AltGr layers."""
         return self._get_geometry([0, Layer.ALTGR])
 
-    @property
+    @functools.cached_property
     def altgr(self):
         """AltGr layer only."""
         return self._get_geometry([Layer.ALTGR])
@@ -392,7 +438,7 @@ class KeyboardLayout:
     # OS-specific drivers: keylayout, klc, xkb, xkb_patch
     #
 
-    @property
+    @functools.cached_property
     def keylayout(self):
         """macOS driver"""
         out = load_tpl(self, ".keylayout")
@@ -402,7 +448,7 @@ class KeyboardLayout:
         out = substitute_lines(out, "TERMINATORS", osx_terminators(self))
         return out
 
-    @property
+    @functools.cached_property
     def ahk(self):
         """Windows AHK driver"""
         out = load_tpl(self, ".ahk")
@@ -411,7 +457,7 @@ class KeyboardLayout:
         out = substitute_lines(out, "SHORTCUTS", ahk_shortcuts(self))
         return out
 
-    @property
+    @functools.cached_property
     def klc(self):
         """Windows driver (warning: requires CR/LF + UTF16LE encoding)"""
         out = load_tpl(self, ".klc")
@@ -421,14 +467,14 @@ class KeyboardLayout:
         out = substitute_token(out, "encoding", "utf-16le")
         return out
 
-    @property
+    @functools.cached_property
     def xkb(self):  # will not work with Wayland
         """GNU/Linux driver (standalone / user-space)"""
         out = load_tpl(self, ".xkb")
         out = substitute_lines(out, "LAYOUT", xkb_keymap(self, xkbcomp=True))
         return out
 
-    @property
+    @functools.cached_property
     def xkb_patch(self):
         """GNU/Linux driver (xkb patch, system or user-space)"""
         out = load_tpl(self, ".xkb_patch")
@@ -439,7 +485,7 @@ class KeyboardLayout:
     # JSON output: keymap (base+altgr layers) and dead keys
     #
 
-    @property
+    @functools.cached_property
     def json(self):
         """JSON layout descriptor"""
         return {
@@ -455,13 +501,12 @@ class KeyboardLayout:
     # SVG output
     #
 
-    @property
+    @functools.cached_property
     def svg(self):
         """SVG drawing"""
-        # Parse SVG data
-        filepath = os.path.join(os.path.dirname(__file__), "tpl", "x-keyboard.svg")
-        svg = etree.parse(filepath, etree.XMLParser(remove_blank_text=True))
-        ns = {"svg": "http://www.w3.org/2000/svg"}
+        # Copy the parsed SVG template (deep copy keeps the top-level comment)
+        svg = copy.deepcopy(_svg_template())
+        key_nodes = {g.get("id"): g for g in svg.iter(f"{{{SVG_NS['svg']}}}g")}
 
         # Get Layout data
         keymap = web_keymap(self)
@@ -469,33 +514,31 @@ class KeyboardLayout:
         # breakpoint()
         # Fill-in with layout
         for name, chars in keymap.items():
-            for key in svg.xpath(f'//svg:g[@id="{name}"]', namespaces=ns):
-                # Print 1-4 level chars
-                for level_num, char in enumerate(chars, start=1):
-                    if chars[0] == chars[1].lower() and level_num == 1:
-                        # Do not print letters twice (lower and upper)
-                        continue
-
-                    for location in key.xpath(
-                        f"svg:g/svg:text[@class='level{level_num}']", namespaces=ns
-                    ):
-                        if char not in deadkeys:
-                            location.text = char
-                        else:
-                            location.text = "★" if char == "**" else char[1:]
-                            # Apply special class for deadkeys
-                            location.set(
-                                "class", location.get("class") + " deadKey diacritic"
-                            )
-
-                # Print 5-6 levels (1dk deadkeys)
-                if deadkeys and (main_deadkey := deadkeys.get("**")):
-                    for level_num, char in enumerate(chars[:2], start=5):
-                        if dead_char := main_deadkey.get(char):
-                            for location in key.xpath(
-                                f"svg:g/svg:text[@class='level{level_num} dk']",
-                                namespaces=ns,
-                            ):
-                                location.text = dead_char
+            key = key_nodes.get(name)
+            if key is None:
+                continue
+
+            # Print 1-4 level chars
+            for level_num, char in enumerate(chars, start=1):
+                if chars[0] == chars[1].lower() and level_num == 1:
+                    # Do not print letters twice (lower and upper)
+                    continue
+
+                for location in SVG_LEVELS[level_num](key):
+                    if char not in deadkeys:
+                        location.text = char
+                    else:
+                        location.text = "★" if char == "**" else char[1:]
+                        # Apply special class for deadkeys
+                        location.set(
+                            "class", location.get("class") + " deadKey diacritic"
+                        )
+
+            # Print 5-6 levels (1dk deadkeys)
+            if deadkeys and (main_deadkey := deadkeys.get("**")):
+                for level_num, char in enumerate(chars[:2], start=5):
+                    if dead_char := main_deadkey.get(char):
+                        for location in SVG_DK_LEVELS[level_num](key):
+                            location.text = dead_char
 
         return svg
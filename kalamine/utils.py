@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
 import os
+import warnings
 from enum import IntEnum
 
 import yaml
 
+try:  # use the libyaml bindings when PyYAML has been built with them
+    from yaml import CSafeLoader as YAMLLoader
+except ImportError:
+    from yaml import SafeLoader as YAMLLoader
+
+    warnings.warn("PyYAML is built without libyaml, YAML loading is slow")
+
 
 def lines_to_text(lines, indent=""):
     out = ""
@@ -23,9 +31,7 @@ def open_local_file(file_name):
 
 
 def load_data(filename):
-    return yaml.load(
-        open_local_file(os.path.join("data", filename)), Loader=yaml.SafeLoader
-    )
+    return yaml.load(open_local_file(os.path.join("data", filename)), Loader=YAMLLoader)
 
 
 class Layer(IntEnum):
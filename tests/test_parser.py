@@ -1,6 +1,9 @@
 import os
 
+import yaml
+
 from kalamine import KeyboardLayout
+from kalamine.layout import load_descriptor
 
 
 def load_layout(filename):
@@ -46,3 +49,24 @@ def test_layouts():
     layout = load_layout("intl")
     assert layout.dead_keys["**"]["base"] == "euioac.EUIOAC"
     assert layout.dead_keys["**"]["alt"] == "éúíóáç…ÉÚÍÓÁÇ"
+
+
+def test_geometry_change():
+    layout = load_layout("intl")
+    base = layout.base
+    klc = layout.klc
+    layout.geometry = "ERGO"
+    assert layout.base != base
+    assert layout.klc != klc
+
+
+def test_yaml_descriptor(tmp_path):
+    cfg = load_descriptor(os.path.join(".", "layouts", "intl.toml"))
+    yaml_path = tmp_path / "intl.yaml"
+    yaml_path.write_text(yaml.safe_dump(cfg, allow_unicode=True), encoding="utf-8")
+
+    layout = KeyboardLayout(str(yaml_path))
+    expected = load_layout("intl")
+    assert layout.layers == expected.layers
+    assert layout.dead_keys == expected.dead_keys
+    assert layout.meta["name"] == expected.meta["name"]